@@ -1,25 +1,198 @@
+import hashlib
+import os
+
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+
+# numba 为可选依赖：两键分组求和的热路径用 JIT 紧循环，缺失时退回 np.add.at
+try:
+    from numba import njit
+
+    @njit(cache=True)
+    def _group_sum_2key(codes_a, codes_b, values, n_a, n_b):
+        out = np.zeros((n_a, n_b), dtype=np.float64)
+        for i in range(len(values)):
+            out[codes_a[i], codes_b[i]] += values[i]
+        return out
+except ImportError:
+    def _group_sum_2key(codes_a, codes_b, values, n_a, n_b):
+        out = np.zeros((n_a, n_b), dtype=np.float64)
+        np.add.at(out, (codes_a, codes_b), values)
+        return out
+
+
+def group_sum_2key(df, key_a, key_b, value_col):
+    """两个 category 键上的分组求和，等价于 groupby([a, b], observed=True)[col].sum()。
+
+    直接在整数编码上做 bincount 式累加，绕开 pandas groupby 的调度开销。
+    """
+    codes_a = df[key_a].cat.codes.to_numpy(np.int64)
+    codes_b = df[key_b].cat.codes.to_numpy(np.int64)
+    values = df[value_col].to_numpy(np.float64)
+    valid = (codes_a >= 0) & (codes_b >= 0)
+    if not valid.all():
+        codes_a, codes_b, values = codes_a[valid], codes_b[valid], values[valid]
+    cats_a = df[key_a].cat.categories
+    cats_b = df[key_b].cat.categories
+    totals = _group_sum_2key(codes_a, codes_b, values, len(cats_a), len(cats_b))
+    observed = np.zeros(totals.shape, dtype=bool)
+    observed[codes_a, codes_b] = True
+    ia, ib = np.nonzero(observed)
+    return pd.DataFrame({key_a: cats_a[ia], key_b: cats_b[ib], value_col: totals[ia, ib]})
+
+
+@st.cache_data
+def build_fig(kind, data, **kwargs):
+    """按聚合结果缓存 Plotly 图的字典形式。
+
+    px 构图会为每个点/trace 生成 Python 对象，对重复渲染是纯开销；数据没变时
+    直接命中缓存，调用方用 go.Figure(...) 复原后再做轻量的样式更新。
+    """
+    return getattr(px, kind)(data, **kwargs).to_dict()
+
+
+def isin_mask(col, selected):
+    """category 列上的 isin：标签先转整数编码，再查一张类别数长度的布尔表。
+
+    替代逐行字符串哈希；末尾多留一个恒为 False 的槽位，让缺失值（编码 -1）
+    自然落空。
+    """
+    cats = col.cat.categories
+    lookup = np.zeros(len(cats) + 1, dtype=bool)
+    sel_codes = cats.get_indexer(selected)
+    lookup[sel_codes[sel_codes >= 0]] = True
+    return lookup[col.cat.codes.to_numpy()]
+
+
+# plotly-resampler 为可选依赖：曲线点数过多时先降采样（MinMaxLTTB）再发给浏览器
+try:
+    from plotly_resampler import FigureResampler
+except ImportError:
+    FigureResampler = None
 
 st.set_page_config(page_title="上海教育软件使用看板", layout="wide")
 
+# 单图超过该点数时启用降采样（Plotly 前端在几十万点级别会明显卡顿）
+RESAMPLE_THRESHOLD = 2000
+
+
+def downsample_fig(fig):
+    """长序列折线图交给 plotly-resampler 降采样；依赖缺失或点数不多时原样返回。"""
+    if FigureResampler is None:
+        return fig
+    n_points = sum(len(trace.x) for trace in fig.data if trace.x is not None)
+    if n_points <= RESAMPLE_THRESHOLD:
+        return fig
+    return FigureResampler(fig, default_n_shown_samples=RESAMPLE_THRESHOLD)
+
 # -------------------
 # 加载与预处理
 # -------------------
+CACHE_DIR = ".cache"
+
+# Excel 中必须解码的非数值列；数值列按前缀识别（见下方 ALL_ITEMS 的发现逻辑）
+NEEDED_COLS = ['日期', '区名称', '学校名称', '教师姓名']
+
+
+def _parse_excel(path, engine=None):
+    """解析 Excel，能确定列集合时只保留需要的列。
+
+    calamine 即使只取表头也会急切解析整张表，预读表头再二次读取反而比
+    单次全量读还慢，所以该路径只读一次，之后在内存里裁列并下转 float32。
+    openpyxl 按行惰性读取，usecols 能真正省掉无关列的解码：先读一行表头，
+    存在板块前缀列时把解析限定到必须列 + 板块列。没有前缀列时保持全量，
+    保留按数值类型发现细分项目列的逻辑。
+    """
+    if engine:
+        df = pd.read_excel(path, engine=engine)
+        value_cols = [c for c in df.columns if c.strip().startswith(('板块A', '板块B'))]
+        if value_cols:
+            keep = set(value_cols) | {c for c in df.columns if c.strip() in NEEDED_COLS}
+            df = df[[c for c in df.columns if c in keep]]
+            df[value_cols] = df[value_cols].astype('float32')
+        return df
+    header_cols = list(pd.read_excel(path, nrows=0).columns)
+    value_cols = [c for c in header_cols if c.strip().startswith(('板块A', '板块B'))]
+    kwargs = {}
+    if value_cols:
+        keep = set(value_cols) | {c for c in header_cols if c.strip() in NEEDED_COLS}
+        kwargs['usecols'] = [c for c in header_cols if c in keep]
+        kwargs['dtype'] = {c: 'float32' for c in value_cols}
+    return pd.read_excel(path, **kwargs)
+
+
+def _read_excel_cached(path):
+    """读取 Excel，并用 Parquet 副本缓存解析结果。
+
+    Excel 解析（XML 逐行解析）是冷启动的主要开销。这里按文件内容哈希 + 修改时间
+    生成 .cache/ 下的 Parquet 副本：命中时直接列式读取，跳过整个 Excel 解析路径；
+    未命中时用 calamine 引擎（Rust 实现，需安装 python-calamine）解析后写回副本。
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()
+    mtime = int(os.path.getmtime(path))
+    base = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(CACHE_DIR, f"{base}.{digest}.{mtime}.parquet")
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path)
+    try:
+        df = _parse_excel(path, engine="calamine")
+    except ImportError:
+        # 未安装 python-calamine 时退回默认引擎（openpyxl）
+        df = _parse_excel(path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        df.to_parquet(cache_path)
+    except Exception:
+        # 写缓存失败（如缺少 pyarrow）不影响正常加载
+        pass
+    return df
+
+
 @st.cache_data
 def load_data(path="data_total.xlsx"):
-    df = pd.read_excel(path)
+    df = _read_excel_cached(path)
     # 清理列名空格
     df.columns = df.columns.str.strip()
     if '日期' not in df.columns:
         raise KeyError("缺少必要列: '日期'")
     df['日期'] = pd.to_datetime(df['日期'])
+    # 空白日期解析为 NaT，会把下面标签表的年份范围毒化成 NaN；这些行在基线
+    # 行为里也会被日期筛选排除，这里直接剔除
+    df = df.dropna(subset=['日期'])
     # 计算学年（9月及以后算当年-次年，否则算上一年-当年）
-    df['学年'] = df['日期'].apply(
-        lambda x: f"{x.year}-{x.year+1}" if x.month >= 9 else f"{x.year-1}-{x.year}"
-    )
-    df['月份'] = df['日期'].dt.to_period('M').astype(str)
+    # 标签表只在学年取值范围上构建一次，逐行只剩整数运算，不再做任何字符串
+    # 拼接/分配；from_codes 直接得到有序 category，排序按学年起始年免费可得
+    years = df['日期'].dt.year.to_numpy()
+    months = df['日期'].dt.month.to_numpy()
+    start_year = np.where(months >= 9, years, years - 1)
+    if len(start_year):
+        year_range = np.arange(start_year.min(), start_year.max() + 1)
+        labels = [f"{y}-{y + 1}" for y in year_range]
+        codes = start_year - year_range[0]
+    else:
+        # 空表没有可计算的年份范围（zero-size 数组没有 min/max）
+        labels, codes = [], start_year
+    df['学年'] = pd.Categorical.from_codes(codes, categories=labels, ordered=True)
+    df['月份'] = df['日期'].dt.strftime('%Y-%m')
+    # 月份用"类别按时间顺序"的有序 category：下游直接 sort_values('月份') 即按
+    # 时间排序，不必再拼 '-01' 重新解析成日期（YYYY-MM 的字典序即时间序）
+    df['月份'] = pd.Categorical(df['月份'], categories=sorted(df['月份'].unique()), ordered=True)
+    # 按日期排好序，主界面的日期范围筛选就能用二分查找切片而不是全列比较
+    df = df.sort_values('日期').reset_index(drop=True)
+    # 看板展示只到两位小数，float32 足够；数值列减半内存后聚合带宽也随之减半
+    # （usecols 路径已按 float32 读入，这里兜底覆盖数值回退发现的列）
+    float_cols = df.select_dtypes(include='float').columns
+    if len(float_cols):
+        df[float_cols] = df[float_cols].astype(np.float32)
+    # 关键字符串列统一转 category：groupby 走整数编码，unique() 只看类别表，
+    # 同时大幅减少内存占用
+    for c in ['区名称', '学校名称', '教师姓名', '月份', '学年']:
+        if c in df.columns:
+            df[c] = df[c].astype('category')
     return df
 
 try:
@@ -44,6 +217,82 @@ else:
     numeric_cols = [c for c in df.select_dtypes(include='number').columns if c not in known]
     ALL_ITEMS = numeric_cols
 
+# -------------------
+# 预聚合：按 (月份, 学年, 区, 学校) 先汇总一次
+# -------------------
+# 各 tab 每次交互都对全量数据做 groupby 是重复劳动。这里把细粒度汇总
+# 缓存下来，后续交互只需在这张小表上切片/过滤。
+AGG_VALUE_COLS = list(dict.fromkeys(c for c in ['板块A', '板块B'] + ALL_ITEMS if c in df.columns))
+
+
+# polars 为可选依赖：rollup 构建走多线程列式 groupby，结果转回 pandas 供 Plotly 使用
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+
+@st.cache_data
+def monthly_school_agg(df, value_cols):
+    keys = [c for c in ['月份', '学年', '区名称', '学校名称'] if c in df.columns]
+    if pl is not None:
+        agg = (
+            pl.from_pandas(df[keys + value_cols])
+            .group_by(keys)
+            .agg([pl.col(c).sum() for c in value_cols])
+            .to_pandas()
+        )
+        # 往返 polars 会丢失类别表/有序标记，恢复原 category dtype 维持下游约定
+        for c in keys:
+            agg[c] = agg[c].astype(df[c].dtype)
+        return agg
+    return df.groupby(keys, observed=True, sort=False)[value_cols].sum().reset_index()
+
+
+school_agg = monthly_school_agg(df, AGG_VALUE_COLS) if AGG_VALUE_COLS else pd.DataFrame()
+
+
+@st.cache_data
+def widget_options(df):
+    """下拉选项列表只算一次：区列表、全量学校列表、按区分组的学校列表。"""
+    opts = {'districts': [], 'all_schools': [], 'schools_by_district': {}}
+    if '区名称' in df.columns:
+        opts['districts'] = sorted(df['区名称'].dropna().unique().tolist())
+    if '学校名称' in df.columns:
+        opts['all_schools'] = sorted(df['学校名称'].dropna().unique().tolist())
+        if '区名称' in df.columns:
+            opts['schools_by_district'] = {
+                d: sorted(sub['学校名称'].dropna().unique().tolist())
+                for d, sub in df.groupby('区名称', observed=True)
+            }
+    return opts
+
+
+OPTIONS = widget_options(df)
+
+
+@st.cache_resource
+def district_row_indices(df):
+    """各区在全量表中的行号表（groupby 内部索引），哈希查表代替整列布尔掩码。"""
+    if '区名称' not in df.columns:
+        return {}
+    return df.groupby('区名称', observed=True, sort=False).indices
+
+
+DISTRICT_ROWS = district_row_indices(df)
+
+
+@st.cache_resource
+def school_row_indices(frame):
+    """各学校在给定表中的行号表，按校取行时直接查表而不扫全表。"""
+    if '学校名称' not in frame.columns:
+        return {}
+    return frame.groupby('学校名称', observed=True, sort=False).indices
+
+
+SCHOOL_AGG_ROWS = school_row_indices(school_agg)
+DF_SCHOOL_ROWS = school_row_indices(df)
+
 # -------------------
 # 侧边栏筛选（全局）
 # -------------------
@@ -67,75 +316,99 @@ else:
     end_date = pd.to_datetime(date_range)
 
 # 区与学校选择（全局）
-districts = sorted(df['区名称'].dropna().unique().tolist()) if '区名称' in df.columns else []
-district_options = ['全部区域'] + districts
+district_options = ['全部区域'] + OPTIONS['districts']
 selected_district = st.sidebar.selectbox("选择区（全局）", district_options)
 
-# 根据区筛选可选学校列表
-if '学校名称' in df.columns:
-    if selected_district != '全部区域':
-        school_choices = sorted(df[df['区名称'] == selected_district]['学校名称'].dropna().unique().tolist())
-    else:
-        school_choices = sorted(df['学校名称'].dropna().unique().tolist())
+# 根据区筛选可选学校列表（选项表已缓存，避免每次 rerun 重算 unique + 排序）
+if selected_district != '全部区域':
+    school_choices = OPTIONS['schools_by_district'].get(selected_district, [])
 else:
-    school_choices = []
+    school_choices = OPTIONS['all_schools']
 
 selected_schools = st.sidebar.multiselect("选择学校（全局，多选，留空表示全部）", school_choices)
 
 # -------------------
 # 根据侧边栏筛选数据（后续所有 tab 共用 filtered_df）
 # -------------------
-filtered_df = df[(df['日期'] >= start_date) & (df['日期'] <= end_date)]
+# df 在 load_data 中已按日期排序，日期范围用二分查找定位行区间。
+# 全局筛选只产出一个行号数组 filtered_idx（升序、无重复），
+# 各 tab 的二次筛选与它求交集即可，不再各自重复整列掩码
+date_values = df['日期'].to_numpy()
+date_lo = int(np.searchsorted(date_values, start_date.to_datetime64(), side='left'))
+date_hi = int(np.searchsorted(date_values, end_date.to_datetime64(), side='right'))
 if selected_district != '全部区域':
-    filtered_df = filtered_df[filtered_df['区名称'] == selected_district]
-if selected_schools:
-    filtered_df = filtered_df[filtered_df['学校名称'].isin(selected_schools)]
+    # 预存的区行号是升序的（df 已按日期排序），直接二分出日期区间内的行
+    district_rows = DISTRICT_ROWS.get(selected_district, np.empty(0, dtype=np.int64))
+    lo = np.searchsorted(district_rows, date_lo)
+    hi = np.searchsorted(district_rows, date_hi)
+    filtered_idx = district_rows[lo:hi]
+else:
+    filtered_idx = np.arange(date_lo, date_hi, dtype=np.int64)
+if selected_schools and '学校名称' in df.columns:
+    filtered_idx = filtered_idx[isin_mask(df['学校名称'].take(filtered_idx), selected_schools)]
+filtered_df = df.take(filtered_idx)
 
 if filtered_df.empty:
     st.warning("筛选后没有数据。请调整日期/区/学校筛选条件。")
 
+# 预聚合表上应用同样的筛选（tabs 2-4 使用月度聚合，日期范围按月对齐）
+if not school_agg.empty:
+    start_month = start_date.strftime('%Y-%m')
+    end_month = end_date.strftime('%Y-%m')
+    agg_months = school_agg['月份'].astype(str)
+    agg_in_range = school_agg[(agg_months >= start_month) & (agg_months <= end_month)]
+    if selected_district != '全部区域' and '区名称' in agg_in_range.columns:
+        agg_in_range = agg_in_range[agg_in_range['区名称'] == selected_district]
+    if selected_schools and '学校名称' in agg_in_range.columns:
+        agg_in_range = agg_in_range[isin_mask(agg_in_range['学校名称'], selected_schools)]
+else:
+    agg_in_range = school_agg
+
 # -------------------
 # 页面主体：Tabs
 # -------------------
 st.title("📊 教育软件使用情况看板（修订版）")
-tabs = st.tabs(["区域总体概览", "区内学校对比", "指定学校对比", "单校详细分析"])
+# st.tabs 每次 rerun 都会执行所有 tab 的代码块；改用横向 radio 充当页签，
+# 只执行当前选中页面的聚合/绘图流水线
+TAB_NAMES = ["区域总体概览", "区内学校对比", "指定学校对比", "单校详细分析"]
+active_tab = st.radio("页面", TAB_NAMES, horizontal=True, label_visibility='collapsed')
 
 # --- Tab 1: 区域总体概览 ---
-with tabs[0]:
+if active_tab == "区域总体概览":
     st.subheader("整体使用趋势")
     group_col = '月份' if time_unit == "按月" else '学年'
     sum_cols = [c for c in ['板块A', '板块B'] if c in filtered_df.columns]
     if not sum_cols:
         st.info("数据中缺少 '板块A' 和 '板块B' 列，无法绘制总体趋势。")
     else:
-        trend_data = filtered_df.groupby(group_col)[sum_cols].sum().reset_index()
+        # observed=True：category 键只聚合实际出现的组合，避免笛卡尔积膨胀；
+        # sort=False：后面会按时间重排，这里省掉一次按键排序
+        trend_data = filtered_df.groupby(group_col, observed=True, sort=False)[sum_cols].sum().reset_index()
 
         # 为了正确排序，当按月份时以时间顺序排序；当按学年时按学年起始年份排序
         if group_col == '月份':
-            # 生成真实日期以排序（每月第一天）
-            trend_data['月份_dt'] = pd.to_datetime(trend_data['月份'] + '-01')
-            trend_data = trend_data.sort_values('月份_dt')
+            # 月份是有序 category，直接排序即按时间顺序
+            trend_data = trend_data.sort_values('月份')
             order = trend_data['月份'].tolist()
-            fig1 = px.line(trend_data, x='月份', y=sum_cols, markers=True, title="整体增长趋势",
-                           category_orders={'月份': order})
+            fig1 = go.Figure(build_fig('line', trend_data, x='月份', y=sum_cols, markers=True,
+                                       title="整体增长趋势", category_orders={'月份': order}))
             fig1.update_xaxes(title="月份")
         else:
-            # 学年排序（取学年起始年）
-            trend_data['学年_start'] = trend_data['学年'].str.split('-').str[0].astype(int)
-            trend_data = trend_data.sort_values('学年_start')
+            # 学年已是类别按起始年排列的有序 category，直接排序
+            trend_data = trend_data.sort_values('学年')
             order = trend_data['学年'].tolist()
-            fig1 = px.line(trend_data, x='学年', y=sum_cols, markers=True, title="整体增长趋势",
-                           category_orders={'学年': order})
+            fig1 = go.Figure(build_fig('line', trend_data, x='学年', y=sum_cols, markers=True,
+                                       title="整体增长趋势", category_orders={'学年': order}))
             fig1.update_xaxes(title="学年")
 
         # 显示悬停数值与 marker
         fig1.update_traces(mode='lines+markers', hovertemplate='%{y:.2f}<extra>%{fullData.name}</extra>')
         fig1.update_layout(legend_title_text="指标")
-        st.plotly_chart(fig1, use_container_width=True)
-        st.dataframe(trend_data.drop(columns=[c for c in ['月份_dt', '学年_start'] if c in trend_data.columns]))
+        st.plotly_chart(downsample_fig(fig1), use_container_width=True)
+        st.dataframe(trend_data)
 
 # --- Tab 2: 区内学校对比 ---
-with tabs[1]:
+if active_tab == "区内学校对比":
     st.subheader("区内学校对比（使用侧边栏的区/学校筛选）")
     if '学校名称' not in filtered_df.columns:
         st.info("没有 '学校名称' 列，无法展示区内学校对比。")
@@ -143,16 +416,20 @@ with tabs[1]:
         # 如果侧边栏未选学校，给出区域内学校选择（最多10个）
         local_district = selected_district if selected_district != '全部区域' else None
         if local_district:
-            district_df = df[df['区名称'] == local_district]
+            local_school_options = OPTIONS['schools_by_district'].get(local_district, [])
         else:
-            district_df = df.copy()
+            local_school_options = OPTIONS['all_schools']
 
-        local_schools = st.multiselect("选择学校进行对比（最多10个）", sorted(district_df['学校名称'].dropna().unique()), key="tab2_schools")
+        local_schools = st.multiselect("选择学校进行对比（最多10个）", local_school_options, key="tab2_schools")
         if local_schools:
             if len(local_schools) > 10:
                 st.warning("最多只能对比 10 所学校，已取前 10 个")
                 local_schools = local_schools[:10]
-            comp_df = filtered_df[filtered_df['学校名称'].isin(local_schools)]
+            # 没有任何数值列时预聚合表是无列空表，不能按 学校名称 取列
+            if school_agg.empty:
+                comp_df = agg_in_range
+            else:
+                comp_df = agg_in_range[isin_mask(agg_in_range['学校名称'], local_schools)]
             if comp_df.empty:
                 st.info("筛选后无数据。")
             else:
@@ -161,41 +438,51 @@ with tabs[1]:
                 if compare_col is None:
                     st.info("数据中既没有 '板块A' 也没有 '板块B'，无法绘图。")
                 else:
-                    school_trend = comp_df.groupby(['月份', '学校名称'])[compare_col].sum().reset_index()
-                    # 保证月份按时间排序
-                    school_trend['月份_dt'] = pd.to_datetime(school_trend['月份'] + '-01')
-                    school_trend = school_trend.sort_values('月份_dt')
-                    fig2 = px.line(school_trend, x='月份', y=compare_col, color='学校名称', markers=True,
-                                   title=f"{local_district or '所选区域'} 各校 {compare_col} 使用对比")
+                    school_trend = comp_df.groupby(['月份', '学校名称'], observed=True, sort=False)[compare_col].sum().reset_index()
+                    # 月份是有序 category，排序即按时间顺序
+                    school_trend = school_trend.sort_values('月份')
+                    fig2 = go.Figure(build_fig('line', school_trend, x='月份', y=compare_col,
+                                               color='学校名称', markers=True,
+                                               title=f"{local_district or '所选区域'} 各校 {compare_col} 使用对比"))
                     fig2.update_traces(mode='lines+markers', hovertemplate='%{y:.2f}<extra>%{fullData.name}</extra>')
                     fig2.update_xaxes(title="月份")
-                    st.plotly_chart(fig2, use_container_width=True)
+                    st.plotly_chart(downsample_fig(fig2), use_container_width=True)
 
 # --- Tab 3: 指定学校对比（跨区） ---
-with tabs[2]:
+if active_tab == "指定学校对比":
     st.subheader("跨区学校对比")
-    all_schools = sorted(df['学校名称'].dropna().unique()) if '学校名称' in df.columns else []
+    all_schools = OPTIONS['all_schools']
     comp_schools = st.multiselect("跨区选择学校（最多20个）", all_schools, key="tab3_schools")
     target_col = st.selectbox("对比维度", options=[c for c in (['板块A', '板块B'] + ALL_ITEMS) if c in df.columns])
     if comp_schools:
         if len(comp_schools) > 20:
             st.warning("最多只能对比 20 所学校，已取前 20 个")
             comp_schools = comp_schools[:20]
-        comp_df = filtered_df[filtered_df['学校名称'].isin(comp_schools)]
+        if school_agg.empty:
+            comp_df = agg_in_range
+        else:
+            # 按校取出行号再 take，只触碰所选学校的行；之后在小表上重放全局筛选
+            school_rows = [SCHOOL_AGG_ROWS[s] for s in comp_schools if s in SCHOOL_AGG_ROWS]
+            comp_df = school_agg.take(np.concatenate(school_rows)) if school_rows else school_agg.iloc[:0]
+            comp_months = comp_df['月份'].astype(str)
+            comp_df = comp_df[(comp_months >= start_month) & (comp_months <= end_month)]
+            if selected_district != '全部区域' and '区名称' in comp_df.columns:
+                comp_df = comp_df[comp_df['区名称'] == selected_district]
+            if selected_schools:
+                comp_df = comp_df[isin_mask(comp_df['学校名称'], selected_schools)]
         if comp_df.empty:
             st.info("筛选后无数据。")
         else:
-            comp_agg = comp_df.groupby(['月份', '学校名称'])[target_col].sum().reset_index()
-            comp_agg['月份_dt'] = pd.to_datetime(comp_agg['月份'] + '-01')
-            comp_agg = comp_agg.sort_values('月份_dt')
-            fig3 = px.bar(comp_agg, x='月份', y=target_col, color='学校名称', barmode='group',
-                          title=f"{target_col} 跨校对比")
+            comp_agg = comp_df.groupby(['月份', '学校名称'], observed=True, sort=False)[target_col].sum().reset_index()
+            comp_agg = comp_agg.sort_values('月份')
+            fig3 = go.Figure(build_fig('bar', comp_agg, x='月份', y=target_col, color='学校名称',
+                                       barmode='group', title=f"{target_col} 跨校对比"))
             fig3.update_traces(hovertemplate='%{y:.2f}<extra>%{fullData.name}</extra>')
             fig3.update_xaxes(title="月份")
             st.plotly_chart(fig3, use_container_width=True)
 
 # --- Tab 4: 单校详细分析（教师对比板块A） ---
-with tabs[3]:
+if active_tab == "单校详细分析":
     st.subheader("单校详细分析 — 教师板块A对比")
     if '学校名称' not in filtered_df.columns:
         st.info("没有 '学校名称' 列，无法进行单校分析。")
@@ -203,7 +490,9 @@ with tabs[3]:
         target_school = st.selectbox("选择目标学校（受侧边栏筛选影响）",
                                      options=sorted(filtered_df['学校名称'].dropna().unique()),
                                      key="single_school")
-        school_detail = filtered_df[filtered_df['学校名称'] == target_school]
+        # 目标学校的行号与全局筛选行号求交集（两者都升序无重复），免去布尔掩码
+        target_rows = DF_SCHOOL_ROWS.get(target_school, np.empty(0, dtype=np.int64))
+        school_detail = df.take(np.intersect1d(filtered_idx, target_rows, assume_unique=True))
         if school_detail.empty:
             st.info("所选学校在当前筛选条件下无数据。")
         else:
@@ -216,30 +505,36 @@ with tabs[3]:
                     if len(teachers) > 10:
                         st.warning("最多可选择 10 位教师，已取前 10 位")
                         teachers = teachers[:10]
-                    tdf = school_detail[school_detail['教师姓名'].isin(teachers)]
+                    tdf = school_detail[isin_mask(school_detail['教师姓名'], teachers)]
                     if '板块A' not in tdf.columns:
                         st.info("没有 '板块A' 列，无法比较教师使用量。")
                     else:
-                        teacher_df = tdf.groupby(['月份', '教师姓名'])['板块A'].sum().reset_index()
-                        teacher_df['月份_dt'] = pd.to_datetime(teacher_df['月份'] + '-01')
-                        teacher_df = teacher_df.sort_values('月份_dt')
-                        fig4 = px.line(teacher_df, x='月份', y='板块A', color='教师姓名', markers=True,
-                                       title=f"{target_school} 教师板块A使用量对比")
+                        teacher_df = group_sum_2key(tdf, '月份', '教师姓名', '板块A')
+                        # 月份类别本身按时间排序，字符串序即时间序
+                        teacher_df = teacher_df.sort_values('月份')
+                        fig4 = go.Figure(build_fig('line', teacher_df, x='月份', y='板块A',
+                                                   color='教师姓名', markers=True,
+                                                   title=f"{target_school} 教师板块A使用量对比"))
                         fig4.update_traces(mode='lines+markers', hovertemplate='%{y:.2f}<extra>%{fullData.name}</extra>')
                         fig4.update_xaxes(title="月份")
-                        st.plotly_chart(fig4, use_container_width=True)
+                        st.plotly_chart(downsample_fig(fig4), use_container_width=True)
 
             # 板块细分项目饼图（如果有可用的 ALL_ITEMS）
             if ALL_ITEMS:
                 st.markdown("### 细分项目分布（所选学校）")
-                # 取学校内所有月份的总和作为分布
-                item_sum = school_detail[ALL_ITEMS].sum(numeric_only=True).reset_index()
-                item_sum.columns = ['项目', '使用量']
+                # 取学校在当前筛选范围内的总和作为分布；与同 tab 的教师图一样
+                # 基于精确日期切片（school_detail 本身已是单校小表）
+                # 一次性取出数值块做单次向量化归约，避免逐列的 pandas 调度；
+                # 用 float64 累加——细分列走数值回退时可能是大数值 ID 列，
+                # float32 的 24 位尾数会让总和可见地偏差
+                item_arr = school_detail[ALL_ITEMS].to_numpy(dtype=np.float64)
+                item_sum = pd.DataFrame({'项目': ALL_ITEMS, '使用量': item_arr.sum(axis=0)})
                 item_sum = item_sum[item_sum['使用量'] > 0]
                 if item_sum.empty:
                     st.info("暂无细分项目数据可视化。")
                 else:
-                    fig_pie = px.pie(item_sum, values='使用量', names='项目', title="细分项目分布")
+                    fig_pie = go.Figure(build_fig('pie', item_sum, values='使用量', names='项目',
+                                                  title="细分项目分布"))
                     fig_pie.update_traces(textposition='inside', hovertemplate='%{label}: %{value:.2f}<extra></extra>')
                     st.plotly_chart(fig_pie, use_container_width=True)
             else: